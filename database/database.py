@@ -4,7 +4,8 @@ Originall designed for shop database :(
 
 
 import sqlite3
-from typing import List, Optional, Dict, Any, Tuple
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Any, Tuple, Iterator
 
 class Database:
     def __init__(self, db_file: str):
@@ -14,10 +15,34 @@ class Database:
         self.connection: Optional[sqlite3.Connection] = None # equivalant to Union[X, None] or X | None
         self.cursor: Optional[sqlite3.Cursor] = None
 
+        # generated sql keyed by (table, columns) so repeated shapes skip the string building
+        self._sql_cache: Dict[Tuple, str] = {}
+
+        # how many transaction() blocks are nested inside the outer one, used to name savepoints
+        self._savepoint_depth: int = 0
+
     def open(self) -> None:
         """Open a connection to sqlite3 db"""
         if self.connection is None:
-            self.connection = sqlite3.connect(self.db_file)
+            # bigger statement cache so sqlite doesn't have to re-prepare the same queries
+            # isolation_level=None stops python wrapping every statement in an implicit BEGIN,
+            # transactions are started explicitly where we need them (see transaction)
+            self.connection = sqlite3.connect(self.db_file, cached_statements=256, isolation_level=None)
+
+            # WAL lets readers and writers overlap, in memory databases don't support it
+            if self.db_file != ":memory:":
+                self.connection.execute("PRAGMA journal_mode=WAL")
+
+            # relax fsyncs and give sqlite more room to cache pages
+            self.connection.executescript(
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA temp_store=MEMORY;"
+                "PRAGMA cache_size=-64000;"
+                "PRAGMA mmap_size=268435456;"
+            )
+
+            # rows can be read by column name as well as by index
+            self.connection.row_factory = sqlite3.Row
             self.cursor = self.connection.cursor()
         else:
             print("database connection is already open")
@@ -41,16 +66,42 @@ class Database:
             table (str): Name of the table to insert data into
             data (Dict[str, Any]): Dictionary of colum-value pairs to insert
         """
-        sql: str = f"INSERT INTO {table} ({', '.join(data.keys())}) VALUES ({', '.join(['?'] * len(data))})"
+        sql: str = self._insert_sql(table, tuple(data.keys()))
         try:
             self.cursor.execute(sql, tuple(data.values()))
-            self.commit()
             print(f"Inserted {data} into {table}")
         except Exception as e:
             print(f"Error Failed to insert into {table}: {e}")
             raise
 
-    def query(self, sql_query: str, params: Optional[Tuple[Any]] = None) -> List[Tuple]:
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Insert many rows into specified table in a single transaction
+
+        Args:
+            table (str): Name of the table to insert data into
+            rows (List[Dict[str, Any]]): List of column-value pair dictionaries, all with the same columns
+
+        Raises:
+            ValueError: If the rows don't all share the same columns
+        """
+        if not rows:
+            return
+
+        columns: Tuple[str, ...] = tuple(rows[0].keys())
+        if any(row.keys() != rows[0].keys() for row in rows):
+            raise ValueError(f"All rows inserted into {table} must have the same columns")
+
+        sql: str = self._insert_sql(table, columns)
+        try:
+            # one transaction so there is only one commit (and fsync) for the whole batch
+            with self.transaction():
+                self.cursor.executemany(sql, [tuple(row[col] for col in columns) for row in rows])
+            print(f"Inserted {len(rows)} rows into {table}")
+        except Exception as e:
+            print(f"Error Failed to insert into {table}: {e}")
+            raise
+
+    def query(self, sql_query: str, params: Optional[Tuple[Any]] = None) -> List[sqlite3.Row]:
         """_summary_
 
         Args:
@@ -58,7 +109,7 @@ class Database:
             params (Optional[Tuple[Any]], optional): Optional paramters for the query. Defaults to None.
 
         Returns:
-            List[Tuple]: _description_
+            List[sqlite3.Row]: every row returned by the query
         """
         if params is None:
             params = () 
@@ -68,7 +119,27 @@ class Database:
         print(f"query: {sql_query} | Params: {params} => Rows returned: {len(rows)}")
         return rows
     
-    def search(self, table: str, search_query: Optional[Dict[str, Any]] = None) -> List[Tuple]:
+    def iter_query(self, sql_query: str, params: Optional[Tuple[Any]] = None) -> Iterator[sqlite3.Row]:
+        """Execute a query and yield the rows one at a time instead of fetching them all
+
+        Args:
+            sql_query (str): query to execute
+            params (Optional[Tuple[Any]], optional): Optional paramters for the query. Defaults to None.
+
+        Yields:
+            Iterator[sqlite3.Row]: each row returned by the query
+        """
+        if params is None:
+            params = ()
+
+        # own cursor so other queries run while iterating don't reset it
+        cursor: sqlite3.Cursor = self.connection.execute(sql_query, params)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def search(self, table: str, search_query: Optional[Dict[str, Any]] = None) -> List[sqlite3.Row]:
         """search db rowsin specified table that match the given criteria
 
         Args:
@@ -76,18 +147,23 @@ class Database:
             search_query (Dict[str, Any]): Dictionary of column-value pairs to match
 
         Returns:
-            List[Tuple]: a list of tuples representing matching rows
+            List[sqlite3.Row]: a list of rows (readable by column name or index) matching the criteria
         """
-        sql: str = f"SELECT * FROM {table}"
-        conditions: List[str] = []
+        sql: str = self._search_sql(table, tuple(search_query.keys()) if search_query else ())
+        return self.query(sql, tuple(search_query.values()) if search_query else ())
 
-        if search_query:
-            conditions.append(" AND ".join([f"{col} = ?" for col in search_query.keys()]))
+    def iter_search(self, table: str, search_query: Optional[Dict[str, Any]] = None) -> Iterator[sqlite3.Row]:
+        """Same as search but yields the matching rows one at a time instead of returning a list
 
-        if conditions:
-            sql += " WHERE " + " AND ".join(conditions)
+        Args:
+            table (str):  Name of the table to search
+            search_query (Dict[str, Any]): Dictionary of column-value pairs to match
 
-        return self.query(sql, tuple(search_query.values()) if search_query else ())
+        Yields:
+            Iterator[sqlite3.Row]: each matching row
+        """
+        sql: str = self._search_sql(table, tuple(search_query.keys()) if search_query else ())
+        return self.iter_query(sql, tuple(search_query.values()) if search_query else ())
     
     def delete(self, table: str, search_query: Dict[str, Any]) -> None:
         """delete the rows from specified table
@@ -96,9 +172,9 @@ class Database:
             table (str): Name of the table to delete from
             search_query (Dict[str, Any]): Dictionary of column-value pairs to match
         """
-        sql: str = f"DELETE FROM {table} WHERE {' AND '.join([f"{col} = ?" for col in search_query.keys()])}"
-        self.cursor.execute(sql, tuple(search_query.keys()))
-        print("Deleted rows from {table} where {search_query}")
+        sql: str = self._delete_sql(table, tuple(search_query.keys()))
+        self.cursor.execute(sql, tuple(search_query.values()))
+        print(f"Deleted rows from {table} where {search_query}")
 
     def update(self, table: str, update_data: Dict[str, Any], search_query: Dict[str, Any]) -> None:
         """_summary_
@@ -108,10 +184,90 @@ class Database:
             update_data (Dict[str, Any]): _description_
             search_query (Dict[str, Any]): _description_
         """
-        sql: str = f"UPDATE {table} SET {', '.join([f"{col} = ?" for col in update_data.keys()])} WHERE {' AND '.join([f"{col} = ?" for col in search_query.keys()])}"
+        sql: str = self._update_sql(table, tuple(update_data.keys()), tuple(search_query.keys()))
         self.cursor.execute(sql, tuple(update_data.values()) + tuple(search_query.values()))
         print(f"Updated {table} set {update_data} where {search_query}")
     
+    """
+    SQL builders, each statement is built once per (table, columns) and then reused from the cache
+    """
+    def _insert_sql(self, table: str, columns: Tuple[str, ...]) -> str:
+        """Build (or fetch from cache) an INSERT statement for the given columns"""
+        key: Tuple = ("insert", table, columns)
+        sql: Optional[str] = self._sql_cache.get(key)
+        if sql is None:
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            self._sql_cache[key] = sql
+        return sql
+
+    def _search_sql(self, table: str, columns: Tuple[str, ...]) -> str:
+        """Build (or fetch from cache) a SELECT statement matching the given columns"""
+        key: Tuple = ("search", table, columns)
+        sql: Optional[str] = self._sql_cache.get(key)
+        if sql is None:
+            sql = f"SELECT * FROM {table}"
+            if columns:
+                sql += " WHERE " + " AND ".join(f"{col} = ?" for col in columns)
+            self._sql_cache[key] = sql
+        return sql
+
+    def _delete_sql(self, table: str, columns: Tuple[str, ...]) -> str:
+        """Build (or fetch from cache) a DELETE statement matching the given columns"""
+        key: Tuple = ("delete", table, columns)
+        sql: Optional[str] = self._sql_cache.get(key)
+        if sql is None:
+            sql = f"DELETE FROM {table} WHERE " + " AND ".join(f"{col} = ?" for col in columns)
+            self._sql_cache[key] = sql
+        return sql
+
+    def _update_sql(self, table: str, set_columns: Tuple[str, ...], where_columns: Tuple[str, ...]) -> str:
+        """Build (or fetch from cache) an UPDATE statement setting and matching the given columns"""
+        key: Tuple = ("update", table, set_columns, where_columns)
+        sql: Optional[str] = self._sql_cache.get(key)
+        if sql is None:
+            sql = (f"UPDATE {table} SET " + ", ".join(f"{col} = ?" for col in set_columns)
+                   + " WHERE " + " AND ".join(f"{col} = ?" for col in where_columns))
+            self._sql_cache[key] = sql
+        return sql
+
+    @contextmanager
+    def transaction(self) -> Iterator["Database"]:
+        """Run everything inside the with block as one transaction
+
+        Commits when the block finishes and rolls back if it raises. If a transaction is already
+        open the block runs inside a savepoint instead, so if it raises only its own changes are
+        rolled back and the outer transaction carries on. This lets insert_many etc. be used inside one.
+
+        Example:
+            with db.transaction():
+                for row in rows:
+                    db.insert("invoices", row)
+        """
+        if self.connection.in_transaction:
+            self._savepoint_depth += 1
+            savepoint: str = f"sp_{self._savepoint_depth}"
+            self.cursor.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield self
+            except BaseException:
+                self.cursor.execute(f"ROLLBACK TO {savepoint}")
+                self.cursor.execute(f"RELEASE {savepoint}")
+                raise
+            else:
+                self.cursor.execute(f"RELEASE {savepoint}")
+            finally:
+                self._savepoint_depth -= 1
+            return
+
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            self.connection.rollback()
+            raise
+        else:
+            self.commit()
+
     def commit(self) -> None:
         """commit any current transactions"""
         if self.connection:
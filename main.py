@@ -1,11 +1,13 @@
 from __future__ import print_function, unicode_literals
 import re
 import os
+import sys
+import atexit
 
 from enum import Enum
 import sqlite3
 from database.database import Database
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Iterable, FrozenSet
 
 from InquirerPy import inquirer
 from InquirerPy.base.control import Choice
@@ -21,7 +23,16 @@ PHONE_TYPES: List[Tuple[str, int]] = [
     ("Superior", 950)
 ]
 VAT_RATE: float = 0.2
+PHONE_COST: Dict[str, int] = dict(PHONE_TYPES)
 PHONE_CHOICES: List[Choice] = [ Choice(value=x[0], name=f"{x[0]} £{x[1]}") for x in PHONE_TYPES ]
+# one row of the invoice table printed by pretty_print_invoices
+INVOICE_ROW_FORMAT: str = ("{:<2} | {:<13} | {:<11} | {:<10} | {:<12} | "
+                           "{:<8} | £{:<6.2f} | £{:<10.2f} | £{:<10.2f} | £{:<15.2f}")
+VALID_COMMANDS: FrozenSet[int] = frozenset((1, 2))
+# escape sequences to clear the terminal, only used when SUPPORTS_ANSI is True
+CLEAR_SCREEN_SEQUENCE: str = "\x1b[2J\x1b[H"
+# UK phone number regex (https://stackoverflow.com/a/44327689) compiled once instead of on every keystroke
+PHONE_NUMBER_PATTERN: re.Pattern = re.compile(r"^(?:07\d{8,12}|447\d{7,11})$")
 
 """
 Different PhoneOptions identified by an enum
@@ -32,6 +43,13 @@ class PhoneOptions(Enum):
     OPTION_B    = 2
     OPTION_NULL = 3
 
+# setup cost per phone for each option
+SETUP_COST: Dict[int, int] = {
+    PhoneOptions.OPTION_A.value: 30,
+    PhoneOptions.OPTION_B.value: 50,
+    PhoneOptions.OPTION_NULL.value: 0
+}
+
 class PhoneNumberValidator(Validator):
     def __init__(self, message: str = "Phone number is invalid"):
         self._message = message
@@ -50,7 +68,7 @@ class PhoneNumberValidator(Validator):
                 cursor_position=document.cursor_position,
             )
         
-        if not re.match(r"^(07\d{8,12}|447\d{7,11})$", document.text):
+        if not PHONE_NUMBER_PATTERN.match(document.text):
             raise ValidationError(message=self._message, cursor_position=document.cursor_position)
 
 class CommandSelectValidator(Validator):
@@ -65,7 +83,7 @@ class CommandSelectValidator(Validator):
         Raises:
             ValidationError: if the integer given is not 1 or 2
         """
-        if int(document.text) not in [1, 2]:
+        if int(document.text) not in VALID_COMMANDS:
             raise ValidationError(
                 message=self._message,
                 cursor_position=document.cursor_position,
@@ -116,7 +134,7 @@ def calculate_cost(phone_type: str, quantity: int, options: int) -> Tuple[float,
     """
 
     # find the base cost of the selected phone type
-    base_cost = next((cost for name, cost in PHONE_TYPES if name == phone_type), None)
+    base_cost = PHONE_COST.get(phone_type)
 
     if base_cost is None:
         raise ValueError(f"Invalid phone type selected: {phone_type}")
@@ -125,11 +143,7 @@ def calculate_cost(phone_type: str, quantity: int, options: int) -> Tuple[float,
     options = int(options)
 
     # search through a dictionary
-    setup_cost: int = {
-        PhoneOptions.OPTION_A.value: 30,
-        PhoneOptions.OPTION_B.value: 50,
-        PhoneOptions.OPTION_NULL.value: 0
-    }[options]
+    setup_cost: int = SETUP_COST[options]
 
     item_price: Any = base_cost * quantity
     setup_opt_price: Any = setup_cost * quantity
@@ -140,12 +154,30 @@ def calculate_cost(phone_type: str, quantity: int, options: int) -> Tuple[float,
 
     return round(float(setup_opt_price), 2), round(float(total_cost_before_vat), 2), round(float(vat), 2), round(float(total_cost_with_vat), 2)
 
-def insert_invoice(company_name: str, company_num: str, smart_phone_type: str,
+def insert_invoices(db: Database, invoices: List[Dict[str, Any]]) -> bool:
+    """Insert many invoices into the database at once
+
+    Args:
+        db (Database): Open database connection shared by the whole program
+        invoices (List[Dict[str, Any]]): Invoices to insert, each one a column-value dictionary like insert_invoice builds
+
+    Returns:
+        bool: True if every invoice was inserted, False if one of the company names already exists
+    """
+    try:
+        db.insert_many("invoices", invoices)
+        return True
+    except sqlite3.IntegrityError as e:
+        print(f"Error user already exists: {e}")
+        return False
+
+def insert_invoice(db: Database, company_name: str, company_num: str, smart_phone_type: str,
                    selected_option: int, quantity_num: int, setup_cost_opt: float,
-                   vat: float, total_cost: float, total_with_vat: float) -> None:
+                   vat: float, total_cost: float, total_with_vat: float) -> bool:
     """Insert an invoice into the database
 
     Args:
+        db (Database): Open database connection shared by the whole program
         company_name (str): Company name to be inserted has to be unique
         company_num (str): Company phone number
         smart_phone_type (str): Phone type [Basic, Standard, Superiror]
@@ -155,7 +187,7 @@ def insert_invoice(company_name: str, company_num: str, smart_phone_type: str,
         total_cost (float): Total cost
         total_with_vat (float): Total cost + VAT
     """
-    data: Dict[str, str] = {
+    data: Dict[str, Any] = {
         "company_name": company_name,
         "company_num": company_num,
         "phone_type": smart_phone_type,
@@ -167,15 +199,9 @@ def insert_invoice(company_name: str, company_num: str, smart_phone_type: str,
         "total_cost_vat": total_with_vat,
     }
 
-    try:
-        with Database("customers.db") as db:
-            db.insert("invoices", data)
-        return True
-    except sqlite3.IntegrityError as e:
-        print(f"Error user already exists: {e}")
-        return False
+    return insert_invoices(db, [data])
 
-def handle_customer() -> bool:
+def handle_customer(db: Database) -> bool:
     """Handles user input """
     company_name: str = inquirer.text(message="Company Name =>", validate=EmptyInputValidator()).execute()
     company_num: str = inquirer.text(message="Company phone number => ", validate=PhoneNumberValidator()).execute()
@@ -227,7 +253,7 @@ def handle_customer() -> bool:
             f"Total Cost including VAT: £{total_with_vat:.2f}"
             )
         
-        if insert_invoice(company_name, company_num, smart_phone_type, 
+        if insert_invoice(db, company_name, company_num, smart_phone_type, 
                        selected_option, quantity_num, setup_opt,
                         vat, total_cost, total_with_vat) == True:
             input()
@@ -241,38 +267,97 @@ def handle_customer() -> bool:
         print(f"Error => {e}")
         input()
 
-def pretty_print_invoices(invoices: List[Tuple]):
+def pretty_print_invoices(invoices: Iterable[sqlite3.Row]):
     """Pretty print and make a table to display the invoices
 
     Args:
-        invoices (List[Tuple]): List of invoices for example (row[0], row[1], row[2], ...)
+        invoices (Iterable[sqlite3.Row]): Invoices to print, can be a list or a row iterator for example row["id"], row["company_name"], ...
     """
-    if not invoices:
+    printed_header: bool = False
+
+    for invoice in invoices:
+        if not printed_header:
+            # print a table like thing
+            print("ID | Company Name | Company Num | Phone Type | Phone Option | Quantity | VAT    | Setup Cost | Total Cost | Total Cost with VAT")
+            print("-" * 115)  # line for separation
+            printed_header = True
+
+        # invoice is a sqlite3.Row so read each column by name
+        print(INVOICE_ROW_FORMAT.format(invoice["id"], invoice["company_name"], invoice["company_num"],
+                                        invoice["phone_type"], invoice["phone_opt"], invoice["quantity"],
+                                        invoice["vat"], invoice["total_setup_cost"], invoice["total_cost"],
+                                        invoice["total_cost_vat"]))
+
+    if not printed_header:
         print("No invoices found.")
         return
 
-    # print a table like thing
-    print("ID | Company Name | Company Num | Phone Type | Phone Option | Quantity | VAT    | Setup Cost | Total Cost | Total Cost with VAT")
-    print("-" * 115)  # line for separation
-
-    # because invoice is a tuple assign each value of the tuple. Example (row[0], row[1]) - (invoice_id, company_name)
-    for invoice in invoices:
-        invoice_id, company_name, company_num, phone_type, phone_opt, quantity, vat, total_setup_cost, total_cost, total_with_vat = invoice
-        print(f"{invoice_id:<2} | {company_name:<13} | {company_num:<11} | {phone_type:<10} | {phone_opt:<12} | "
-              f"{quantity:<8} | £{vat:<6.2f} | £{total_setup_cost:<10.2f} | £{total_cost:<10.2f} | £{total_with_vat:<15.2f}")
-        
     input()
 
 
-def read_all_invoices() -> None:
-    with Database("customers.db") as db:
-        result = db.search("invoices")
-        pretty_print_invoices(result)
+def read_all_invoices(db: Database) -> None:
+    # stream the rows straight from sqlite instead of loading the whole table into a list
+    pretty_print_invoices(db.iter_search("invoices"))
+
+# stdout is None when running under pythonw
+STDOUT_IS_TTY: bool = sys.stdout is not None and sys.stdout.isatty()
 
-def input_invoice():
+def enable_ansi_support() -> bool:
+    """Try to make the terminal understand ANSI escape sequences
+
+    Windows consoles (from windows 10) can process them but only once the program turns on
+    ENABLE_VIRTUAL_TERMINAL_PROCESSING, which python doesn't do for us.
+
+    Returns:
+        bool: True if escape sequences written to stdout will be understood
+    """
+    # no screen to clear when output is piped or there is no stdout at all (pythonw)
+    if not STDOUT_IS_TTY:
+        return False
+
+    if os.name != "nt":
+        return True
+
+    import ctypes
+
+    STD_OUTPUT_HANDLE: int = -11
+    ENABLE_VIRTUAL_TERMINAL_PROCESSING: int = 0x0004
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.GetStdHandle.restype = ctypes.c_void_p
+    kernel32.GetConsoleMode.argtypes = (ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong))
+    kernel32.SetConsoleMode.argtypes = (ctypes.c_void_p, ctypes.c_ulong)
+
+    handle = kernel32.GetStdHandle(STD_OUTPUT_HANDLE)
+    mode = ctypes.c_ulong()
+    if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+        return False
+
+    if mode.value & ENABLE_VIRTUAL_TERMINAL_PROCESSING:
+        return True
+
+    # fails on consoles older than windows 10 which don't know the flag
+    return bool(kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING))
+
+# checked once at start up so the menu loop doesn't have to
+SUPPORTS_ANSI: bool = enable_ansi_support()
+
+def clear_screen() -> None:
+    """Clear the terminal, writes the escape sequence directly instead of spawning a shell when possible
+
+    Only old windows consoles that can't process escape sequences still shell out to cls,
+    when stdout isn't a terminal there is nothing to clear so this does nothing.
+    """
+    if SUPPORTS_ANSI:
+        sys.stdout.write(CLEAR_SCREEN_SEQUENCE)
+        sys.stdout.flush()
+    elif STDOUT_IS_TTY and os.name == "nt":
+        os.system("cls")
+
+def input_invoice(db: Database):
     print("====== MASA Telecommunications =====")
     while True:
-        os.system("cls")
+        clear_screen()
         select = inquirer.select(
             message="Choose function =>",
             choices=[
@@ -285,15 +370,14 @@ def input_invoice():
 
         match select:
             case 1: 
-                read_all_invoices()
+                read_all_invoices(db)
             case 2:
-                handle_customer()
+                handle_customer(db)
             case _:
                 raise ValueError("Incorrect command") # shouldn't get to this due to validator
 
-def init_database() -> None:
-    with Database("customers.db") as db:
-        db.cursor.execute(
+def init_database(db: Database) -> None:
+    db.cursor.execute(
 """
 CREATE TABLE IF NOT EXISTS invoices (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -308,11 +392,21 @@ CREATE TABLE IF NOT EXISTS invoices (
     total_cost_vat FLOAT NOT NULL
 )
 """)
+    # company_name is already indexed by UNIQUE, these are for filtering by phone type or number
+    # with db.search, nothing searches by them yet so they only cost a little on each insert
+    db.cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_phone_type ON invoices(phone_type)")
+    db.cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_company_num ON invoices(company_num)")
+    db.commit()
 
 def main() -> None:
-    init_database()
+    # one connection for the lifetime of the program instead of reconnecting for every invoice
+    db: Database = Database("customers.db")
+    db.open()
+    atexit.register(db.close)
+
+    init_database(db)
 
-    input_invoice()
+    input_invoice(db)
 
 
 if __name__ == "__main__":